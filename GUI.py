@@ -1,14 +1,29 @@
 import streamlit as st
-import pandas as pd
 import joblib
-from utils import explain_score_model
+from utils import explain_score_model, score_and_prob
 import numpy as np
 
-# Load model components
-weights = joblib.load("model_weights.pkl")
-intercept = joblib.load("model_intercept.pkl")
-feature_order = joblib.load("X_train_columns.pkl")
-scaler = joblib.load("scaler.pkl")
+# Load model components once per process; Streamlit reruns reuse the cached objects
+@st.cache_resource
+def load_artifacts():
+    # Scoring runs in float32; the logistic score does not need float64 precision
+    weights = joblib.load("model_weights.pkl").astype(np.float32)
+    intercept = np.float32(joblib.load("model_intercept.pkl"))
+    feature_order = joblib.load("X_train_columns.pkl")
+    scaler = joblib.load("scaler.pkl")
+
+    # Column positions in the model's feature order, resolved once instead of per rerun
+    scaled_cols = list(scaler.feature_names_in_)
+    feature_index = {name: i for i, name in enumerate(feature_order)}
+    scaled_idx = np.array([feature_index[c] for c in scaled_cols])
+
+    # StandardScaler parameters, applied directly to the scaled columns (same as scaler.transform)
+    scaler_mean = scaler.mean_ if scaler.with_mean else 0.0
+    scaler_scale = scaler.scale_ if scaler.with_std else 1.0
+    return weights, intercept, feature_order, feature_index, scaled_idx, scaler_mean, scaler_scale
+
+
+weights, intercept, feature_order, FEATURE_INDEX, SCALED_IDX, SCALER_MEAN, SCALER_SCALE = load_artifacts()
 
 # Updated Mapping dictionaries with unique float values
 airway_map = {"Ventilation": 10, "Intubation": 9.25, "Low oxygen": 7.52, "Stable": 0}
@@ -97,72 +112,120 @@ echo_map = {
 }
 
 
+# Model feature -> (form widget key, encoder); None means the widget value is used as-is
+FIELD_SPECS = [
+    ("Age", "Age", None),
+    ("Sex", "Gender", lambda v: 1 if v == "Male" else 0),
+    ("Duration of illness at the time of admission (days)", "Duration_illness", None),
+    ("Duration of hospital stay (days)", "Duration_stay", None),
+    ("Requirement for ICU at admission", "ICU", lambda v: 1 if v == "Yes" else 0),
+    ("Airway & breathing", "Airway", airway_map.__getitem__),
+    ("Circulation", "Circulation", lambda v: 0 if v == "Stable" else 1),
+    ("Respiratory system", "Resp", lambda v: 0 if v == "Normal" else 1),
+    ("Cardiovascular system", "CVS", lambda v: 0 if v == "Normal" else 1),
+    ("Renal", "Renal", renal_map.__getitem__),
+    ("Hematological", "Hemato", hematological_map.__getitem__),
+    ("Gastrointestinal and Hepatic", "GI", gi_map.__getitem__),
+    ("Nervous system", "Neuro", lambda v: 0 if v == "Normal" else 1),
+    ("CO-MORBIDITY", "Comorb", co_morb_map.__getitem__),
+    ("Complications", "Comp", complications_map.__getitem__),
+    ("GRBS/ random blood sugar (mg/dL)", "GRBS", None),
+    ("Total protein (g/dl)", "Total_Protein", None),
+    ("Serum albumin (g/dl)", "Albumin", None),
+    ("Prothrombin time (PT)", "PT", None),
+    ("Activated partial thromboplastin time (APTT)", "APTT", None),
+    ("Urea (mg/dL)", "Urea", None),
+    ("Sodium (mM/l)", "Sodium", None),
+    ("Potassium (mM/l)", "Potassium", None),
+    ("pH", "pH", None),
+    ("PO2 (mmHg)", "PO2", None),
+    ("PCO2 (mmHg)", "PCO2", None),
+    ("Bicarb (mmol/l)", "Bicarb", None),
+    ("Lactate (mol/L)", "Lactate", None),
+    ("CPK (U/L)", "CPK", None),
+    ("CPK-MB (U/L)", "CPK_MB", None),
+    ("CRP (mg/L)", "CRP", None),
+    ("Procalcitonin (ng/ml)", "PCT", None),
+    ("Serum ferritin (ng/ml)", "Ferritin", None),
+    ("LDH (U/L)", "LDH", None),
+    ("d Dimer (mcg/ml)", "D_Dimer", None),
+    ("USG abdomen", "USG", lambda v: 0 if v == "Normal" else 1),
+    ("ECHO", "ECHO", echo_map.__getitem__),
+    ("Hemoglobin", "Hb", None),
+    ("Platelet", "Platelet", None),
+    ("Total leukocyte count", "WBC", None),
+    ("Total bilirubin", "TB", None),
+    ("Direct bilirubin", "DB", None),
+    ("AST", "AST", None),
+    ("ALT", "ALT", None),
+    ("Creatinine", "Creatinine", None)
+]
+
+
 # Streamlit page layout
 st.set_page_config(page_title="Mortality Risk Predictor", layout="wide")
 st.title("🧠 Mortality Risk Prediction for AFI Patients with Thrombocytopenia")
 st.markdown("Enter patient details to assess mortality risk and get SHAP-based explanation.")
 
-if "form_submitted" not in st.session_state:
-    st.session_state["form_submitted"] = False
-
 # User input form
 with st.form("input_form"):
     col1, col2, col3 = st.columns(3)
     with col1:
-        Age = st.number_input("Age", 0, 120, 45)
-        Gender = st.selectbox("Sex", ["Male", "Female"])
-        Duration_illness = st.number_input("Duration of illness at admission (days)", 0, 60, 3)
-        Duration_stay = st.number_input("Duration of hospital stay (days)", 0, 60, 5)
-        ICU = st.selectbox("Requirement for ICU at admission", ["No", "Yes"])
-        Airway = st.selectbox("Airway & Breathing", list(airway_map.keys()))
-        Circulation = st.selectbox("Circulation", ["Stable", "Unstable"])
-        Resp = st.selectbox("Respiratory system", ["Normal", "Abnormal"])
-        CVS = st.selectbox("Cardiovascular system", ["Normal", "Abnormal"])
-        Renal = st.selectbox("Renal", list(renal_map.keys()))
-        Hemato = st.selectbox("Hematological", list(hematological_map.keys()))
+        Age = st.number_input("Age", 0, 120, 45, key="Age")
+        Gender = st.selectbox("Sex", ["Male", "Female"], key="Gender")
+        Duration_illness = st.number_input("Duration of illness at admission (days)", 0, 60, 3, key="Duration_illness")
+        Duration_stay = st.number_input("Duration of hospital stay (days)", 0, 60, 5, key="Duration_stay")
+        ICU = st.selectbox("Requirement for ICU at admission", ["No", "Yes"], key="ICU")
+        Airway = st.selectbox("Airway & Breathing", list(airway_map.keys()), key="Airway")
+        Circulation = st.selectbox("Circulation", ["Stable", "Unstable"], key="Circulation")
+        Resp = st.selectbox("Respiratory system", ["Normal", "Abnormal"], key="Resp")
+        CVS = st.selectbox("Cardiovascular system", ["Normal", "Abnormal"], key="CVS")
+        Renal = st.selectbox("Renal", list(renal_map.keys()), key="Renal")
+        Hemato = st.selectbox("Hematological", list(hematological_map.keys()), key="Hemato")
     with col2:
-        GI = st.selectbox("Gastrointestinal and Hepatic", list(gi_map.keys()))
-        Neuro = st.selectbox("Nervous System", ["Normal", "Abnormal"])
-        Comorb = st.selectbox("Co -Morbidity", list(co_morb_map.keys()))
-        Comp = st.selectbox("Complications", list(complications_map.keys()))
-        GRBS = st.number_input("GRBS (mg/dL)", 0.0, 500.0, 120.0)
-        Total_Protein = st.number_input("Total Protein (g/dl)", 0.0, 10.0, 6.5)
-        Albumin = st.number_input("Serum Albumin (g/dl)", 0.0, 5.0, 3.5)
-        PT = st.number_input("Prothrombin Time (PT)", 5.0, 50.0, 12.5)
-        APTT = st.number_input("APTT", 5.0, 80.0, 30.0)
-        Urea = st.number_input("Urea (mg/dL)", 0.0, 200.0, 30.0)
-        Sodium = st.number_input("Sodium (mM/l)", 100.0, 180.0, 135.0)
+        GI = st.selectbox("Gastrointestinal and Hepatic", list(gi_map.keys()), key="GI")
+        Neuro = st.selectbox("Nervous System", ["Normal", "Abnormal"], key="Neuro")
+        Comorb = st.selectbox("Co -Morbidity", list(co_morb_map.keys()), key="Comorb")
+        Comp = st.selectbox("Complications", list(complications_map.keys()), key="Comp")
+        GRBS = st.number_input("GRBS (mg/dL)", 0.0, 500.0, 120.0, key="GRBS")
+        Total_Protein = st.number_input("Total Protein (g/dl)", 0.0, 10.0, 6.5, key="Total_Protein")
+        Albumin = st.number_input("Serum Albumin (g/dl)", 0.0, 5.0, 3.5, key="Albumin")
+        PT = st.number_input("Prothrombin Time (PT)", 5.0, 50.0, 12.5, key="PT")
+        APTT = st.number_input("APTT", 5.0, 80.0, 30.0, key="APTT")
+        Urea = st.number_input("Urea (mg/dL)", 0.0, 200.0, 30.0, key="Urea")
+        Sodium = st.number_input("Sodium (mM/l)", 100.0, 180.0, 135.0, key="Sodium")
     with col3:
-        Potassium = st.number_input("Potassium (mM/l)", 2.0, 6.0, 4.0)
-        pH = st.number_input("pH", 6.5, 8.0, 7.4)
-        PO2 = st.number_input("PO2 (mmHg)", 0.0, 200.0, 90.0)
-        PCO2 = st.number_input("PCO2 (mmHg)", 10.0, 80.0, 40.0)
-        Bicarb = st.number_input("Bicarbonate (mmol/l)", 5.0, 40.0, 22.0)
-        Lactate = st.number_input("Lactate (mol/L)", 0.0, 15.0, 1.2)
-        CPK = st.number_input("CPK (U/L)", 0.0, 10000.0, 150.0)
-        CPK_MB = st.number_input("CPK-MB (U/L)", 0.0, 1000.0, 25.0)
-        CRP = st.number_input("CRP (mg/L)", 0.0, 400.0, 10.0)
-        PCT = st.number_input("Procalcitonin (ng/ml)", 0.0, 100.0, 0.5)
-        Ferritin = st.number_input("Serum Ferritin (ng/ml)", 0.0, 5000.0, 200.0)
+        Potassium = st.number_input("Potassium (mM/l)", 2.0, 6.0, 4.0, key="Potassium")
+        pH = st.number_input("pH", 6.5, 8.0, 7.4, key="pH")
+        PO2 = st.number_input("PO2 (mmHg)", 0.0, 200.0, 90.0, key="PO2")
+        PCO2 = st.number_input("PCO2 (mmHg)", 10.0, 80.0, 40.0, key="PCO2")
+        Bicarb = st.number_input("Bicarbonate (mmol/l)", 5.0, 40.0, 22.0, key="Bicarb")
+        Lactate = st.number_input("Lactate (mol/L)", 0.0, 15.0, 1.2, key="Lactate")
+        CPK = st.number_input("CPK (U/L)", 0.0, 10000.0, 150.0, key="CPK")
+        CPK_MB = st.number_input("CPK-MB (U/L)", 0.0, 1000.0, 25.0, key="CPK_MB")
+        CRP = st.number_input("CRP (mg/L)", 0.0, 400.0, 10.0, key="CRP")
+        PCT = st.number_input("Procalcitonin (ng/ml)", 0.0, 100.0, 0.5, key="PCT")
+        Ferritin = st.number_input("Serum Ferritin (ng/ml)", 0.0, 5000.0, 200.0, key="Ferritin")
 
     # Final section
-    LDH = st.number_input("LDH (U/L)", 0.0, 2000.0, 300.0)
-    D_Dimer = st.number_input("D -Dimer (mcg/ml)", 0.0, 50.0, 0.8)
-    USG = st.selectbox("USG Abdomen", ["Normal", "Abnormal"])
-    ECHO = st.selectbox("ECHO", list(echo_map.keys()))
-    Hb = st.number_input("Hemoglobin (g/dL)", 0.0, 20.0, 12.0)
-    Platelet = st.number_input("Platelet (/mm3)", 0.0, 600000.0, 140000.0)
-    WBC = st.number_input("Total Leukocyte Count", 0.0, 30000.0, 8000.0)
-    TB = st.number_input("Total Bilirubin", 0.0, 20.0, 1.0)
-    DB = st.number_input("Direct Bilirubin", 0.0, 10.0, 0.5)
-    AST = st.number_input("AST (U/L)", 0.0, 1000.0, 50.0)
-    ALT = st.number_input("ALT (U/L)", 0.0, 1000.0, 50.0)
-    Creatinine = st.number_input("Creatinine", 0.0, 20.0, 1.0)
+    LDH = st.number_input("LDH (U/L)", 0.0, 2000.0, 300.0, key="LDH")
+    D_Dimer = st.number_input("D -Dimer (mcg/ml)", 0.0, 50.0, 0.8, key="D_Dimer")
+    USG = st.selectbox("USG Abdomen", ["Normal", "Abnormal"], key="USG")
+    ECHO = st.selectbox("ECHO", list(echo_map.keys()), key="ECHO")
+    Hb = st.number_input("Hemoglobin (g/dL)", 0.0, 20.0, 12.0, key="Hb")
+    Platelet = st.number_input("Platelet (/mm3)", 0.0, 600000.0, 140000.0, key="Platelet")
+    WBC = st.number_input("Total Leukocyte Count", 0.0, 30000.0, 8000.0, key="WBC")
+    TB = st.number_input("Total Bilirubin", 0.0, 20.0, 1.0, key="TB")
+    DB = st.number_input("Direct Bilirubin", 0.0, 10.0, 0.5, key="DB")
+    AST = st.number_input("AST (U/L)", 0.0, 1000.0, 50.0, key="AST")
+    ALT = st.number_input("ALT (U/L)", 0.0, 1000.0, 50.0, key="ALT")
+    Creatinine = st.number_input("Creatinine", 0.0, 20.0, 1.0, key="Creatinine")
 
     submitted = st.form_submit_button("🧾 Predict and Explain")
-    if submitted:
-        st.session_state["form_submitted"] = True
-if st.session_state["form_submitted"]:
+
+# Predict in the same run as the submit click; the flag keeps results visible on later reruns
+if submitted or st.session_state.get("form_submitted"):
+    st.session_state["form_submitted"] = True
     view_mode = st.radio(
         "📋 Select Report Type:",
         ["Model View", "Clinical View"],
@@ -188,63 +251,20 @@ if st.session_state["form_submitted"]:
         "Sex": Gender
     }
 
-    input_dict = {
-        "Age": Age,
-        "Sex": 1 if Gender == "Male" else 0,
-        "Duration of illness at the time of admission (days)": Duration_illness,
-        "Duration of hospital stay (days)": Duration_stay,
-        "Requirement for ICU at admission": 1 if ICU == "Yes" else 0,
-        "Airway & breathing": airway_map[Airway],
-        "Circulation": 0 if Circulation == "Stable" else 1,
-        "Respiratory system": 0 if Resp == "Normal" else 1,
-        "Cardiovascular system": 0 if CVS == "Normal" else 1,
-        "Renal": renal_map[Renal],
-        "Hematological": hematological_map[Hemato],
-        "Gastrointestinal and Hepatic": gi_map[GI],
-        "Nervous system": 0 if Neuro == "Normal" else 1,
-        "CO-MORBIDITY": co_morb_map[Comorb],
-        "Complications": complications_map[Comp],
-        "GRBS/ random blood sugar (mg/dL)": GRBS,
-        "Total protein (g/dl)": Total_Protein,
-        "Serum albumin (g/dl)": Albumin,
-        "Prothrombin time (PT)": PT,
-        "Activated partial thromboplastin time (APTT)": APTT,
-        "Urea (mg/dL)": Urea,
-        "Sodium (mM/l)": Sodium,
-        "Potassium (mM/l)": Potassium,
-        "pH": pH,
-        "PO2 (mmHg)": PO2,
-        "PCO2 (mmHg)": PCO2,
-        "Bicarb (mmol/l)": Bicarb,
-        "Lactate (mol/L)": Lactate,
-        "CPK (U/L)": CPK,
-        "CPK-MB (U/L)": CPK_MB,
-        "CRP (mg/L)": CRP,
-        "Procalcitonin (ng/ml)": PCT,
-        "Serum ferritin (ng/ml)": Ferritin,
-        "LDH (U/L)": LDH,
-        "d Dimer (mcg/ml)": D_Dimer,
-        "USG abdomen": 0 if USG == "Normal" else 1,
-        "ECHO": echo_map[ECHO],
-        "Hemoglobin": Hb,
-        "Platelet": Platelet,
-        "Total leukocyte count": WBC,
-        "Total bilirubin": TB,
-        "Direct bilirubin": DB,
-        "AST": AST,
-        "ALT": ALT,
-        "Creatinine": Creatinine
-    }
-
-    df_new = pd.DataFrame([input_dict])
     try:
-        scaled_columns = scaler.transform(df_new[scaler.feature_names_in_])
-        scaled_df = pd.DataFrame(scaled_columns, columns=scaler.feature_names_in_)
-        df_combined = pd.concat([scaled_df, df_new.drop(columns=scaler.feature_names_in_)], axis=1)
-        df_score_input = df_combined.reindex(columns=feature_order)
-        X_input = df_score_input.values.astype(float)
-        score = float(np.dot(X_input, weights) + intercept)
-        prob = float(1 / (1 + np.exp(-score)))
+        input_dict = {
+            key: conv(st.session_state[var]) if conv else st.session_state[var]
+            for key, var, conv in FIELD_SPECS
+        }
+
+        # Fill a single row buffer in model order and scale the scaler's columns in place.
+        # Raw values stay float64 so reference-range checks see the exact entered values.
+        X_raw = np.empty((1, len(feature_order)), dtype=np.float64)
+        for k, v in input_dict.items():
+            X_raw[0, FEATURE_INDEX[k]] = v
+        X_input = X_raw.astype(np.float32)
+        X_input[0, SCALED_IDX] = (X_raw[0, SCALED_IDX] - SCALER_MEAN) / SCALER_SCALE
+        prob = float(score_and_prob(X_input[0], weights, intercept))
 
         if prob >= 0.7:
             outcome = "🟢 Low Risk of Mortality"
@@ -259,9 +279,9 @@ if st.session_state["form_submitted"]:
 
         shap_df = explain_score_model(
             score_weights=weights,
-            input_df=df_score_input,
-            reference_order=feature_order,
-            original_input_df=df_new,
+            input_vec=X_input[0],
+            feature_names=feature_order,
+            original_values=X_raw[0],
             original_text_map=original_input_text,
             mode=view_mode
         )
@@ -270,7 +290,7 @@ if st.session_state["form_submitted"]:
         st.error(f"⚠️ Error during prediction: {ex}")
 
 # Optional: Reset button
-if st.session_state["form_submitted"]:
+if st.session_state.get("form_submitted"):
     if st.button("🔁 Reset Form"):
         st.session_state["form_submitted"] = False
         st.experimental_rerun()
\ No newline at end of file
@@ -5,6 +5,7 @@ import numpy as np
 import streamlit as st
 import matplotlib.pyplot as plt
 import io
+import math
 
 from reportlab.lib.pagesizes import A4
 from reportlab.lib import colors
@@ -73,9 +74,27 @@ CATEGORICAL_HINTS = {
     "ECHO": "Severe dysfunction indicates need for cardiology consult."
 }
 
+# Reference ranges as aligned arrays for vectorized range checks
+REF_KEYS = np.array(list(REFERENCE_RANGES))
+REF_LOWS = np.array([v[0] for v in REFERENCE_RANGES.values()])
+REF_HIGHS = np.array([v[1] for v in REFERENCE_RANGES.values()])
+_CAT_KEYS = frozenset(CATEGORICAL_HINTS)
 
+# Risk bar glyphs for the PDF table, indexed by bar length
+_BARS = tuple("█" * i for i in range(16))
 
-def generate_pdf_table(explanation_df, mode="Model View"):
+
+def score_and_prob(X, weights, intercept):
+    # Works for a single row or a (n_rows, n_features) batch
+    score = X @ weights + intercept
+    if np.ndim(score) == 0:
+        # A single row yields a scalar score; math.exp avoids NumPy ufunc dispatch for one value
+        return 1.0 / (1.0 + math.exp(-float(score)))
+    return 1.0 / (1.0 + np.exp(-score))
+
+
+def generate_pdf_table(explanation_df_sorted, mode="Model View"):
+    # Expects rows already sorted by ascending Contribution
     buffer = io.BytesIO()
     doc = SimpleDocTemplate(
         buffer,
@@ -104,11 +123,16 @@ def generate_pdf_table(explanation_df, mode="Model View"):
     elements.append(Paragraph("<u>Patient-Specific Mortality Risk Explanation</u>", title_style))
     elements.append(Spacer(1, 6))
 
-    explanation_df_sorted = explanation_df.sort_values(by="Contribution", ascending=True)
-    top_contributors = explanation_df_sorted.head(5)
+    # Plain column arrays; iterating these avoids building a Series per row
+    feat_arr = explanation_df_sorted["Feature"].to_numpy()
+    val_arr = explanation_df_sorted["Input Value"].to_numpy()
+    c_arr = explanation_df_sorted["Contribution"].to_numpy()
+    impact_arr = explanation_df_sorted["Risk Impact"].to_numpy()
+    w_arr = explanation_df_sorted["Risk Weight"].to_numpy() if mode == "Model View" else [None] * len(c_arr)
+
     top_summary = "<br/>".join([
-        f"• <b>{row['Feature']}</b>: {float(row['Contribution']):+.2f}"
-        for _, row in top_contributors.iterrows()
+        f"• <b>{feat}</b>: {float(impact):+.2f}"
+        for feat, impact in zip(feat_arr[:5], c_arr[:5])
     ])
     elements.append(Paragraph("<b>Top Contributors to Mortality Risk:</b>", styles["Normal"]))
     elements.append(Paragraph(top_summary, ParagraphStyle("Summary", fontSize=9, leading=12)))
@@ -125,17 +149,16 @@ def generate_pdf_table(explanation_df, mode="Model View"):
         col_widths = [160, 180, 200]
 
     row_colors = [colors.HexColor("#4B8BBE")]
-    max_impact = max(abs(explanation_df_sorted["Contribution"].min()), abs(explanation_df_sorted["Contribution"].max()))
+    max_impact = max(abs(c_arr.min()), abs(c_arr.max())) if len(c_arr) else 0.0
+    bar_width = len(_BARS) - 1
 
-    def make_risk_bar(value, width=50):
+    def make_risk_bar(value):
         if abs(value) < 0.01:
             return " "
-        symbol = "█" * int((abs(value) / max_impact) * width)
-        return f"{symbol} {'+' if value > 0 else '-'}"
+        return f"{_BARS[int(abs(value) / max_impact * bar_width)]} {'+' if value > 0 else '-'}"
 
-    for _, row in explanation_df_sorted.iterrows():
-        impact = row["Contribution"]
-        bar = make_risk_bar(impact, width=15)
+    for feat, val, weight, impact, impact_text in zip(feat_arr, val_arr, w_arr, c_arr, impact_arr):
+        bar = make_risk_bar(impact)
 
         if impact < 0:
             bg_color = colors.HexColor("#ffe5e5")
@@ -144,18 +167,19 @@ def generate_pdf_table(explanation_df, mode="Model View"):
         else:
             bg_color = colors.beige
 
+        # Only the free-text columns need Paragraph wrapping; short numeric cells stay plain strings
         if mode == "Model View":
             row_data = [
-                Paragraph(str(row["Feature"]), wrap_style),
-                Paragraph(str(row["Input Value"]), wrap_style),
-                Paragraph(f"{row['Score Weight']:.4f}", wrap_style),
-                Paragraph(f"{impact:+.2f} {bar}", wrap_style)
+                Paragraph(str(feat), wrap_style),
+                Paragraph(str(val), wrap_style),
+                f"{weight:.4f}",
+                f"{impact_text} {bar}"
             ]
         else:
             row_data = [
-                Paragraph(str(row["Feature"]), wrap_style),
-                Paragraph(str(row["Input Value"]), wrap_style),
-                Paragraph(f"{impact:+.2f} {bar}", wrap_style)
+                Paragraph(str(feat), wrap_style),
+                Paragraph(str(val), wrap_style),
+                f"{impact_text} {bar}"
             ]
         table_data.append(row_data)
         row_colors.append(bg_color)
@@ -166,8 +190,9 @@ def generate_pdf_table(explanation_df, mode="Model View"):
         ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor("#4B8BBE")),
         ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
         ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('ALIGN', (0, 1), (-1, -1), 'CENTER'),
-        ('ALIGN', (2, 1), (2, -1), 'LEFT') if mode == "Model View" else ('ALIGN', (1, 1), (1, -1), 'LEFT'),
+        ('ALIGN', (2, 1), (-1, -1), 'LEFT'),
+        ('FONTSIZE', (2, 1), (-1, -1), 8),
+        ('LEADING', (2, 1), (-1, -1), 10),
         ('GRID', (0, 0), (-1, -1), 0.4, colors.grey),
     ])
 
@@ -209,6 +234,20 @@ def generate_pdf_table(explanation_df, mode="Model View"):
     return buffer
 
 
+@st.cache_data(max_entries=8, ttl=600)
+def _build_pdf(features, input_values, contributions, risk_impacts, risk_weights, mode):
+    # Hashable inputs so reruns with an unchanged explanation reuse the cached PDF bytes.
+    # The cache is shared by all sessions and keyed on patient data, so keep it small and short-lived.
+    columns = {
+        "Feature": features,
+        "Input Value": input_values,
+        "Contribution": contributions,
+        "Risk Impact": risk_impacts
+    }
+    if risk_weights is not None:
+        columns["Risk Weight"] = risk_weights
+    return generate_pdf_table(pd.DataFrame(columns), mode=mode).getvalue()
+
 
 
 
@@ -216,39 +255,40 @@ def generate_pdf_table(explanation_df, mode="Model View"):
 
 
 
-def explain_score_model(score_weights, input_df, reference_order=None, threshold=0.05, original_input_df=None, original_text_map=None, mode="Model View"):
-    input_array = input_df.values.flatten()
+
+def explain_score_model(score_weights, input_vec, feature_names, threshold=0.05, original_values=None, original_text_map=None, mode="Model View"):
+    # input_vec and original_values are 1-D arrays aligned with feature_names (scaled and raw inputs)
+    input_array = np.asarray(input_vec).ravel()
     contributions = input_array * score_weights
-    abs_contributions = np.abs(contributions)
-    feature_names = reference_order if reference_order else input_df.columns.tolist()
+    order = np.argsort(-np.abs(contributions), kind="stable")
 
-    if original_input_df is not None:
-        original_input_df = original_input_df[feature_names]
-        input_display = original_input_df.values.flatten()
-    else:
-        input_display = input_array
+    input_display = input_array if original_values is None else np.asarray(original_values).ravel()
 
-    input_display_readable = []
-    for feat, val in zip(feature_names, input_display):
-        if original_text_map and feat in original_text_map:
-            input_display_readable.append(original_text_map[feat])
-        else:
-            input_display_readable.append(val)
+    if original_text_map:
+        input_display_readable = (
+            pd.Series(feature_names)
+            .map(original_text_map)
+            .fillna(pd.Series(input_display, dtype=object))
+            .to_numpy()
+        )
+    else:
+        input_display_readable = input_display
 
+    # Rows ordered by absolute contribution; the index keeps each feature's model position
+    contrib_values = contributions[order]
     explanation_df = pd.DataFrame({
-        "Feature": feature_names,
-        "Input Value": input_display_readable,
-        "Score Weight": score_weights,
-        "Contribution": contributions,
-        "Abs Contribution": abs_contributions
-    }).sort_values("Abs Contribution", ascending=False)
+        "Feature": np.asarray(feature_names)[order],
+        "Input Value": np.asarray(input_display_readable, dtype=object)[order],
+        "Contribution": contrib_values
+    }, index=order)
 
-    explanation_df["Risk Impact"] = explanation_df["Contribution"].apply(lambda x: f"+{x:.2f}" if x > 0 else f"{x:.2f}")
-    explanation_df["Risk Weight"] = explanation_df["Score Weight"]
-
-    display_df = explanation_df[["Feature", "Input Value", "Risk Weight", "Risk Impact"]]
+    signs = np.where(contrib_values > 0, "+", "")
+    explanation_df["Risk Impact"] = [f"{s}{v:.2f}" for s, v in zip(signs, contrib_values)]
 
+    # Risk Weight is only shown (and only exported to the PDF) in Model View
     if mode == "Model View":
+        explanation_df["Risk Weight"] = score_weights[order]
+        display_df = explanation_df[["Feature", "Input Value", "Risk Weight", "Risk Impact"]]
         st.write("### 🔢 Feature Contributions (Model View)")
         st.data_editor(
             display_df,
@@ -259,64 +299,77 @@ def explain_score_model(score_weights, input_df, reference_order=None, threshold
             }
         )
     else:
+        display_df = explanation_df[["Feature", "Input Value", "Risk Impact"]]
         st.write("### 🧠 Key Clinical Contributors (Simplified View)")
-        st.table(display_df[["Feature", "Input Value", "Risk Impact"]])
+        st.table(display_df)
 
     st.caption("🔎 Negative Risk Impact indicates increased mortality risk. Positive indicates reduced risk.")
 
     st.write("### 🧾 Clinical Action Recommendations")
-    for _, row in explanation_df.iterrows():
-        if float(row["Contribution"]) < -threshold:
-            feat = row["Feature"]
-            val = row["Input Value"]
-            message = None
-
-            if feat in REFERENCE_RANGES:
-                low, high = REFERENCE_RANGES[feat]
-                try:
-                    val_float = float(val)
-                    if val_float < low:
-                        status = "low"
-                    elif val_float > high:
-                        status = "high"
-                    else:
-                        continue
-                    action = NUMERICAL_ACTION_HINTS.get(feat, "May indicate clinical abnormality — suggest further diagnostic evaluation based on context.")
-                    message = f"- **{feat}** is **{status}** ({val}). {action}"
-                except:
-                    pass
-            elif feat in CATEGORICAL_HINTS:
-                message = f"- **{feat}** contributed significantly → {CATEGORICAL_HINTS[feat]}"
-
-            if message:
-                st.markdown(message)
+    feats = explanation_df["Feature"].to_numpy()
+    vals = explanation_df["Input Value"].to_numpy()
+    significant = explanation_df["Contribution"].to_numpy() < -threshold
+
+    # Align each feature to its reference range (-1 when it has none); non-numeric values become NaN and never flag
+    ref_pos = pd.Index(REF_KEYS).get_indexer(feats)
+    has_ref = ref_pos >= 0
+    numeric_vals = pd.to_numeric(pd.Series(vals), errors="coerce").to_numpy(dtype=float)
+    low_mask = significant & has_ref & (numeric_vals < REF_LOWS[ref_pos])
+    high_mask = significant & has_ref & (numeric_vals > REF_HIGHS[ref_pos])
+    cat_mask = significant & ~has_ref & np.array([f in _CAT_KEYS for f in feats], dtype=bool)
+
+    for i in np.flatnonzero(low_mask | high_mask | cat_mask):
+        feat = feats[i]
+        if cat_mask[i]:
+            st.markdown(f"- **{feat}** contributed significantly → {CATEGORICAL_HINTS[feat]}")
+        else:
+            status = "low" if low_mask[i] else "high"
+            action = NUMERICAL_ACTION_HINTS.get(feat, "May indicate clinical abnormality — suggest further diagnostic evaluation based on context.")
+            st.markdown(f"- **{feat}** is **{status}** ({vals[i]}). {action}")
+
+    # Ascending contribution order without a second sort: negatives are already ascending in the
+    # absolute-value order, positives are ascending once reversed
+    ascending = np.concatenate([
+        np.flatnonzero(contrib_values < 0),
+        np.flatnonzero(contrib_values == 0),
+        np.flatnonzero(contrib_values > 0)[::-1]
+    ])
+    sorted_df = explanation_df.iloc[ascending]
 
     # Pass mode to PDF
-    pdf_buf = generate_pdf_table(explanation_df, mode=mode)
+    pdf_bytes = _build_pdf(
+        tuple(sorted_df["Feature"]),
+        tuple(sorted_df["Input Value"]),
+        tuple(sorted_df["Contribution"]),
+        tuple(sorted_df["Risk Impact"]),
+        tuple(sorted_df["Risk Weight"]) if mode == "Model View" else None,
+        mode
+    )
     st.download_button(
         label="⬇️ Download Explanation Summary (PDF)",
-        data=pdf_buf,
+        data=pdf_bytes,
         file_name="score_model_explanation.pdf",
         mime="application/pdf"
     )
 
     # SHAP-style plot
     st.write("### 📉 Feature Impact Visualization")
-    sorted_df = explanation_df.sort_values("Contribution")
     fig, ax = plt.subplots(figsize=(10, len(sorted_df) * 0.25))
     colors = ['green' if val > 0 else 'red' for val in sorted_df["Contribution"]]
     ax.barh(sorted_df["Feature"], sorted_df["Contribution"], color=colors)
     ax.axvline(0, color='black', linestyle='--', linewidth=1)
     ax.set_xlabel("Contribution to Risk Score")
     ax.set_title("All Feature Contributions (Score-Based)")
-    st.pyplot(fig)
 
+    # Render once to PNG and reuse the same bytes for display and download
     buf = io.BytesIO()
-    fig.savefig(buf, format="png", dpi=300, bbox_inches="tight")
-    buf.seek(0)
+    fig.savefig(buf, format="png", dpi=150, bbox_inches="tight")
+    plt.close(fig)
+    png_bytes = buf.getvalue()
+    st.image(png_bytes)
     st.download_button(
         label="⬇️ Download Explanation Plot",
-        data=buf,
+        data=png_bytes,
         file_name="score_feature_contributions.png",
         mime="image/png"
     )